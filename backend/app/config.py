@@ -10,6 +10,17 @@ class Settings(BaseModel):
     app_host: str = "0.0.0.0"
     app_port: int = 8000
     frontend_url: str = "http://localhost:3000"
+    init_db_on_startup: bool = True
+    db_wait_timeout: float = 30.0
+    db_connect_timeout: int = 5
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    db_connection_budget: int = 80
+    ranking_recompute_interval: int = 3600
+    idempotency_ttl: int = 86400
+    bookings_partitions_ahead: int = 3
+    bookings_retention_months: int = 12
+    bookings_archive_dir: str = "/app/archive/bookings"
 
 
 settings = Settings(
@@ -23,4 +34,15 @@ settings = Settings(
     app_host=os.getenv("APP_HOST", "0.0.0.0"),
     app_port=int(os.getenv("APP_PORT", "8000")),
     frontend_url=os.getenv("FRONTEND_URL", "http://localhost:3000"),
+    init_db_on_startup=os.getenv("INIT_DB_ON_STARTUP", "1") == "1",
+    db_wait_timeout=float(os.getenv("DB_WAIT_TIMEOUT", "30")),
+    db_connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+    db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+    db_connection_budget=int(os.getenv("DB_CONNECTION_BUDGET", "80")),
+    ranking_recompute_interval=int(os.getenv("RANKING_RECOMPUTE_INTERVAL", "3600")),
+    idempotency_ttl=int(os.getenv("IDEMPOTENCY_TTL", "86400")),
+    bookings_partitions_ahead=int(os.getenv("BOOKINGS_PARTITIONS_AHEAD", "3")),
+    bookings_retention_months=int(os.getenv("BOOKINGS_RETENTION_MONTHS", "12")),
+    bookings_archive_dir=os.getenv("BOOKINGS_ARCHIVE_DIR", "/app/archive/bookings"),
 )
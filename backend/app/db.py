@@ -1,8 +1,54 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from app.config import settings
 
-engine = create_engine(settings.database_url)
+INIT_LOCK_ID = 260_001
+
+engine = create_engine(
+    settings.database_url,
+    pool_pre_ping=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    connect_args={"connect_timeout": settings.db_connect_timeout},
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
+
+
+def check_db() -> bool:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError:
+        return False
+    return True
+
+
+def wait_for_db(timeout: float = 30.0, interval: float = 0.25) -> None:
+    deadline = time.monotonic() + timeout
+    while not check_db():
+        if time.monotonic() >= deadline:
+            raise RuntimeError("Database not ready")
+        time.sleep(interval)
+
+
+def init_db() -> None:
+    # Импорт регистрирует модели в Base.metadata.
+    from app import idempotency, partitions, ranking
+
+    with engine.begin() as conn:
+        # Несколько процессов могут стартовать одновременно — DDL выполняет только один.
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": INIT_LOCK_ID})
+        partitions.migrate_legacy_table(conn)
+        idempotency.drop_outdated_table(conn)
+        Base.metadata.create_all(bind=conn)
+        # create_all пропускает индексы уже существующих таблиц.
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        partitions.ensure_partitions(conn, settings.bookings_partitions_ahead)
+        ranking.backfill_scores(conn)
@@ -1,10 +1,8 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
-from app.auth import verify_password
-from app.config import settings
+from app.auth import decode_access_token, verify_password
 from app.db import SessionLocal
 from app.models import User
 
@@ -37,13 +35,9 @@ def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        subject: str | None = payload.get("sub")
-        if subject is None:
-            raise credentials_exception
-    except JWTError as exc:
-        raise credentials_exception from exc
+    subject = decode_access_token(token)
+    if subject is None:
+        raise credentials_exception
     user = db.query(User).filter(User.email == subject).first()
     if user is None:
         raise credentials_exception
@@ -0,0 +1,245 @@
+import hashlib
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.auth import decode_access_token
+from app.db import SessionLocal
+from app.models import IdempotencyKey
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+# Сколько держится захват ключа, если обработчик упал вместе с воркером.
+# Должно быть заметно больше WORKER_TIMEOUT: иначе ключ медленного, но живого
+# запроса истечёт, и его выполнит повторный запрос.
+IN_PROGRESS_TIMEOUT = timedelta(minutes=5)
+
+
+@dataclass
+class Claim:
+    outcome: str  # "claimed" | "replay" | "in_progress" | "mismatch"
+    record: IdempotencyKey | None = None
+    token: str | None = None
+
+
+def drop_outdated_table(conn: Connection) -> None:
+    """Таблица — это кэш ответов, поэтому при смене схемы её проще пересоздать."""
+    table = IdempotencyKey.__table__
+    inspector = inspect(conn)
+    if not inspector.has_table(table.name):
+        return
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    if existing != {column.name for column in table.columns}:
+        table.drop(conn)
+
+
+def claim_key(subject: str, key: str, fingerprint: str) -> Claim:
+    now = datetime.utcnow()
+    token = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.subject == subject,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at < now,
+        ).delete(synchronize_session=False)
+        claimed = db.execute(
+            insert(IdempotencyKey)
+            .values(
+                subject=subject,
+                key=key,
+                fingerprint=fingerprint,
+                claim_token=token,
+                created_at=now,
+                expires_at=now + IN_PROGRESS_TIMEOUT,
+            )
+            .on_conflict_do_nothing(index_elements=[IdempotencyKey.subject, IdempotencyKey.key])
+            .returning(IdempotencyKey.key)
+        ).first()
+        db.commit()
+        if claimed:
+            return Claim("claimed", token=token)
+        record = (
+            db.query(IdempotencyKey)
+            .filter(IdempotencyKey.subject == subject, IdempotencyKey.key == key)
+            .first()
+        )
+    if record is None:
+        # Запись истекла и удалена между вставкой и чтением — пусть клиент повторит.
+        return Claim("in_progress")
+    if record.fingerprint != fingerprint:
+        return Claim("mismatch", record)
+    if record.status_code is None:
+        return Claim("in_progress", record)
+    return Claim("replay", record)
+
+
+def complete_key(
+    subject: str,
+    key: str,
+    token: str,
+    status_code: int,
+    headers: list[list[str]],
+    body: bytes,
+    ttl: int,
+) -> None:
+    # Если захват истёк и ключ перехватил другой запрос, токен уже другой —
+    # чужую запись нельзя ни перезаписать, ни удалить (см. release_key).
+    with SessionLocal() as db:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.subject == subject,
+            IdempotencyKey.key == key,
+            IdempotencyKey.claim_token == token,
+        ).update(
+            {
+                IdempotencyKey.status_code: status_code,
+                IdempotencyKey.response_headers: headers,
+                IdempotencyKey.response_body: body,
+                IdempotencyKey.expires_at: datetime.utcnow() + timedelta(seconds=ttl),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+
+
+def release_key(subject: str, key: str, token: str) -> None:
+    with SessionLocal() as db:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.subject == subject,
+            IdempotencyKey.key == key,
+            IdempotencyKey.claim_token == token,
+            IdempotencyKey.status_code.is_(None),
+        ).delete(synchronize_session=False)
+        db.commit()
+
+
+def purge_expired() -> None:
+    with SessionLocal() as db:
+        db.query(IdempotencyKey).filter(IdempotencyKey.expires_at < datetime.utcnow()).delete(
+            synchronize_session=False
+        )
+        db.commit()
+
+
+class IdempotencyMiddleware:
+    """Повторяет сохранённый ответ для POST-запросов с заголовком Idempotency-Key.
+
+    Ключ привязан к пользователю из JWT и к телу запроса. Пока первый запрос
+    обрабатывается, дубликаты получают 409; ответы 5xx не сохраняются, и ключ
+    освобождается для повторной попытки.
+    """
+
+    def __init__(self, app: ASGIApp, paths: list[str], ttl: int):
+        self.app = app
+        self.paths = [re.compile(path) for path in paths]
+        self.ttl = ttl
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not any(path.fullmatch(scope["path"]) for path in self.paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = headers.get(HEADER)
+        authorization = headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        subject = decode_access_token(token) if key and scheme.lower() == "bearer" else None
+        if subject is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Idempotency-Key too long"}, status_code=400)(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        fingerprint = hashlib.sha256(scope["path"].encode() + b"\n" + body).hexdigest()
+
+        claim = await run_in_threadpool(claim_key, subject, key, fingerprint)
+        if claim.outcome == "mismatch":
+            response = JSONResponse(
+                {"detail": "Idempotency-Key reused with a different request"}, status_code=422
+            )
+        elif claim.outcome == "in_progress":
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"},
+                status_code=409,
+                headers={"Retry-After": "1"},
+            )
+        elif claim.outcome == "replay":
+            record = claim.record
+            response = Response(bytes(record.response_body or b""), status_code=record.status_code)
+            response.raw_headers = [
+                (name.encode("latin-1"), value.encode("latin-1"))
+                for name, value in record.response_headers or []
+            ] + [(b"idempotent-replayed", b"true")]
+        else:
+            response = None
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status_code = 500
+        response_headers: list[list[str]] = []
+        chunks: list[bytes] = []
+
+        async def capture_send(message: Message) -> None:
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            # При разрыве соединения задача отменена; без shield ключ остался бы
+            # захваченным до IN_PROGRESS_TIMEOUT.
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(release_key, subject, key, claim.token)
+            raise
+        with anyio.CancelScope(shield=True):
+            if status_code >= 500:
+                await run_in_threadpool(release_key, subject, key, claim.token)
+            else:
+                await run_in_threadpool(
+                    complete_key,
+                    subject,
+                    key,
+                    claim.token,
+                    status_code,
+                    response_headers,
+                    b"".join(chunks),
+                    self.ttl,
+                )
@@ -1,7 +1,11 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
 from fastapi import Depends, FastAPI, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import and_, func, or_
@@ -9,13 +13,15 @@ from sqlalchemy.orm import Session
 
 from app.auth import create_access_token, hash_password
 from app.config import settings
-from app.db import Base, engine
+from app import idempotency, partitions, ranking
+from app.db import check_db, engine, init_db, wait_for_db
 from app.deps import authenticate_user, get_current_user, get_db
-from app.models import Booking, Comment, Favorite, Post, PostLike, Room, User, Venue
+from app.models import Booking, Comment, Favorite, Post, PostLike, Room, User, Venue, VenueScore
 from app.schemas import (
     BookingCreate,
     BookingPublic,
     CommentCreate,
+    CommentPreview,
     CommentPublic,
     FavoritePublic,
     PostCreate,
@@ -30,9 +36,59 @@ from app.schemas import (
     VenuePublic,
 )
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="SmokeCodex Hookah Booking API")
+logger = logging.getLogger(__name__)
+
+
+def recompute_rankings():
+    with engine.connect() as conn:
+        ranking.recompute_scores(conn)
+
+
+async def run_periodically(interval: int, job, run_first: bool = False):
+    if not run_first:
+        await asyncio.sleep(interval)
+    while True:
+        try:
+            await run_in_threadpool(job)
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.init_db_on_startup:
+        await run_in_threadpool(wait_for_db, settings.db_wait_timeout)
+        await run_in_threadpool(init_db)
+    tasks = [
+        asyncio.create_task(run_periodically(600, idempotency.purge_expired)),
+        # Обслуживание идемпотентно и почти ничего не делает, если всё на месте,
+        # поэтому запускается сразу и затем каждый час: перезапуски воркеров не
+        # откладывают его.
+        asyncio.create_task(run_periodically(3600, partitions.maintain, run_first=True)),
+    ]
+    if settings.ranking_recompute_interval > 0:
+        tasks.append(
+            asyncio.create_task(run_periodically(settings.ranking_recompute_interval, recompute_rankings))
+        )
+    print(
+        f"API доступен: http://localhost:{settings.app_port} (Swagger: http://localhost:{settings.app_port}/docs)"
+    )
+    print(f"Фронтенд: {settings.frontend_url}")
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+app = FastAPI(title="SmokeCodex Hookah Booking API", lifespan=lifespan)
+app.add_middleware(
+    idempotency.IdempotencyMiddleware,
+    paths=[r"/bookings", r"/posts", r"/posts/\d+/comments"],
+    ttl=settings.idempotency_ttl,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[settings.frontend_url, "http://localhost:3000"],
@@ -47,6 +103,13 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+    if not check_db():
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
+
 @app.post("/auth/register", response_model=UserPublic, status_code=status.HTTP_201_CREATED)
 def register(payload: UserCreate, db: Session = Depends(get_db)):
     existing = db.query(User).filter(User.email == payload.email).first()
@@ -103,6 +166,8 @@ def create_venue(
 ):
     venue = Venue(owner_id=current_user.id, **payload.model_dump())
     db.add(venue)
+    db.flush()
+    db.add(VenueScore(venue_id=venue.id))
     db.commit()
     db.refresh(venue)
     return venue
@@ -116,6 +181,7 @@ def list_venues(
     min_price: int | None = None,
     max_price: int | None = None,
     has_vip: bool | None = None,
+    sort: Literal["recent", "popular", "trending"] = "recent",
 ):
     query = db.query(Venue)
     filters = []
@@ -132,7 +198,14 @@ def list_venues(
         filters.append(Venue.has_vip == has_vip)
     if filters:
         query = query.filter(and_(*filters))
-    return query.order_by(Venue.created_at.desc()).all()
+    if sort == "recent":
+        return query.order_by(Venue.created_at.desc()).all()
+    score_column = VenueScore.popularity_score if sort == "popular" else VenueScore.trending_score
+    return (
+        query.join(VenueScore, VenueScore.venue_id == Venue.id)
+        .order_by(score_column.desc().nulls_last(), Venue.created_at.desc())
+        .all()
+    )
 
 
 @app.get("/venues/{venue_id}", response_model=VenuePublic)
@@ -186,6 +259,9 @@ def create_booking(
     room = db.query(Room).filter(Room.id == payload.room_id).first()
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
+    earliest, latest = partitions.booking_range()
+    if not earliest <= partitions.to_naive_utc(payload.start_time) < latest:
+        raise HTTPException(status_code=400, detail="start_time is outside the bookable range")
     conflict = db.query(Booking).filter(
         Booking.room_id == payload.room_id,
         Booking.status == "active",
@@ -199,8 +275,11 @@ def create_booking(
         room_id=payload.room_id,
         start_time=payload.start_time,
         end_time=payload.end_time,
+        created_at=datetime.utcnow(),
     )
     db.add(booking)
+    if ranking.booking_counts(payload.start_time):
+        ranking.record_event(db, room.venue_id, ranking.BOOKING_WEIGHT, booking.created_at)
     db.commit()
     db.refresh(booking)
     return booking
@@ -211,11 +290,27 @@ def list_bookings(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     status_filter: str | None = Query(default=None, alias="status"),
+    include_archived: bool = False,
+    archived_from: datetime | None = None,
+    archived_to: datetime | None = None,
 ):
+    if include_archived:
+        if archived_from is None:
+            raise HTTPException(status_code=400, detail="archived_from is required with include_archived")
+        archived_from = partitions.to_naive_utc(archived_from)
+        archived_to = partitions.to_naive_utc(archived_to) if archived_to else datetime.utcnow()
+        if archived_to - archived_from > partitions.MAX_ARCHIVE_RANGE:
+            raise HTTPException(status_code=400, detail="Archive range is limited to 12 months")
     query = db.query(Booking).filter(Booking.user_id == current_user.id)
     if status_filter:
         query = query.filter(Booking.status == status_filter)
-    return query.order_by(Booking.start_time.desc()).all()
+    bookings = query.order_by(Booking.start_time.desc()).all()
+    if include_archived:
+        archived = partitions.read_archived_bookings(
+            current_user.id, archived_from, archived_to, status_filter
+        )
+        bookings = sorted([*bookings, *archived], key=lambda booking: booking.start_time, reverse=True)
+    return bookings
 
 
 @app.delete("/bookings/{booking_id}", response_model=BookingPublic)
@@ -229,6 +324,8 @@ def cancel_booking(
         raise HTTPException(status_code=404, detail="Booking not found")
     if booking.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not allowed")
+    if booking.status == "active" and ranking.booking_counts(booking.start_time):
+        ranking.record_event(db, booking.room.venue_id, -ranking.BOOKING_WEIGHT, booking.created_at)
     booking.status = "cancelled"
     db.add(booking)
     db.commit()
@@ -252,8 +349,9 @@ def add_favorite(
     )
     if existing:
         return existing
-    favorite = Favorite(user_id=current_user.id, venue_id=venue_id)
+    favorite = Favorite(user_id=current_user.id, venue_id=venue_id, created_at=datetime.utcnow())
     db.add(favorite)
+    ranking.record_event(db, venue_id, ranking.FAVORITE_WEIGHT, favorite.created_at)
     db.commit()
     db.refresh(favorite)
     return favorite
@@ -285,6 +383,7 @@ def remove_favorite(
     )
     if not favorite:
         raise HTTPException(status_code=404, detail="Favorite not found")
+    ranking.record_event(db, venue_id, -ranking.FAVORITE_WEIGHT, favorite.created_at)
     db.delete(favorite)
     db.commit()
 
@@ -378,6 +477,49 @@ def list_comments(post_id: int, db: Session = Depends(get_db)):
     )
 
 
+@app.get("/comments", response_model=list[CommentPreview])
+def list_comment_previews(
+    post_ids: str,
+    per_post: int = Query(default=3, ge=0, le=50),
+    db: Session = Depends(get_db),
+):
+    try:
+        ids = list(dict.fromkeys(int(value) for value in post_ids.split(",") if value.strip()))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid post_ids") from exc
+    if not ids:
+        return []
+    if len(ids) > 100:
+        raise HTTPException(status_code=400, detail="Too many post_ids")
+
+    ranked = (
+        db.query(
+            Comment.id.label("id"),
+            func.row_number()
+            .over(partition_by=Comment.post_id, order_by=(Comment.created_at.desc(), Comment.id.desc()))
+            .label("rank"),
+            func.count(Comment.id).over(partition_by=Comment.post_id).label("total"),
+        )
+        .filter(Comment.post_id.in_(ids))
+        .subquery()
+    )
+    rows = (
+        db.query(Comment, ranked.c.total)
+        .join(ranked, ranked.c.id == Comment.id)
+        .filter(ranked.c.rank <= max(per_post, 1))
+        .order_by(Comment.post_id, Comment.created_at.asc(), Comment.id.asc())
+        .all()
+    )
+
+    previews = {post_id: CommentPreview(post_id=post_id, total=0, comments=[]) for post_id in ids}
+    for comment, total in rows:
+        preview = previews[comment.post_id]
+        preview.total = total
+        if per_post:
+            preview.comments.append(CommentPublic.model_validate(comment))
+    return list(previews.values())
+
+
 @app.get("/")
 async def root():
     return {
@@ -385,11 +527,3 @@ async def root():
         "docs": "/docs",
         "frontend": settings.frontend_url,
     }
-
-
-@app.on_event("startup")
-def on_startup():
-    print(
-        f"API доступен: http://localhost:{settings.app_port} (Swagger: http://localhost:{settings.app_port}/docs)"
-    )
-    print(f"Фронтенд: {settings.frontend_url}")
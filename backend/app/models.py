@@ -1,6 +1,19 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    JSON,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    column,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db import Base
@@ -45,6 +58,21 @@ class Venue(Base):
     favorites: Mapped[list["Favorite"]] = relationship(back_populates="venue")
 
 
+class VenueScore(Base):
+    __tablename__ = "venue_scores"
+    # Индексы в порядке сортировки list_venues (DESC NULLS LAST), чтобы её можно было
+    # читать прямо из индекса.
+    __table_args__ = (
+        Index("ix_venue_scores_popularity_desc", column("popularity_score").desc().nulls_last()),
+        Index("ix_venue_scores_trending_desc", column("trending_score").desc().nulls_last()),
+    )
+
+    venue_id: Mapped[int] = mapped_column(ForeignKey("venues.id"), primary_key=True)
+    popularity_score: Mapped[float] = mapped_column(Float, default=0.0)
+    trending_score: Mapped[float | None] = mapped_column(Float, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class Room(Base):
     __tablename__ = "rooms"
 
@@ -61,11 +89,17 @@ class Room(Base):
 
 class Booking(Base):
     __tablename__ = "bookings"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    __table_args__ = (
+        Index("ix_bookings_user_start", "user_id", "start_time"),
+        Index("ix_bookings_room_start", "room_id", "start_time"),
+        {"postgresql_partition_by": "RANGE (start_time)"},
+    )
+
+    # Ключ партиционирования обязан входить в первичный ключ.
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id"))
-    start_time: Mapped[datetime] = mapped_column(DateTime)
+    start_time: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
     end_time: Mapped[datetime] = mapped_column(DateTime)
     status: Mapped[str] = mapped_column(String(30), default="active")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -102,6 +136,7 @@ class Post(Base):
 
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (Index("ix_comments_post_created", "post_id", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"))
@@ -122,3 +157,17 @@ class PostLike(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     post: Mapped[Post] = relationship(back_populates="likes")
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    subject: Mapped[str] = mapped_column(String(255), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64))
+    claim_token: Mapped[str] = mapped_column(String(36))
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    response_headers: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    response_body: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
@@ -0,0 +1,257 @@
+import csv
+import gzip
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.config import settings
+from app.db import engine
+from app.models import Booking
+from app.schemas import BookingPublic
+
+TABLE = Booking.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+ARCHIVE_COLUMNS = ["id", "user_id", "room_id", "start_time", "end_time", "status", "created_at"]
+
+MAINTENANCE_LOCK_ID = 300_001
+# Максимальный период, который можно запросить из архива за один раз.
+MAX_ARCHIVE_RANGE = timedelta(days=366)
+
+
+def _month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def retention_cutoff(now: datetime | None = None) -> datetime | None:
+    """Начало самого старого месяца, который ещё хранится в БД; None — архивация выключена."""
+    if settings.bookings_retention_months <= 0:
+        return None
+    return _add_months(_month_start(now or datetime.utcnow()), -settings.bookings_retention_months)
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """В БД время хранится без часового пояса, в UTC."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def _relkind(conn: Connection, name: str) -> str | None:
+    return conn.execute(
+        text(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = :name AND n.nspname = current_schema()"
+        ),
+        {"name": name},
+    ).scalar()
+
+
+def _partition_tables(conn: Connection) -> dict[str, bool | None]:
+    """Таблицы партиций и их состояние: False — подключена, True — ждёт DETACH FINALIZE,
+    None — уже отсоединена, но ещё не выгружена в архив."""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname, i.inhdetachpending FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = CAST(:table AS regclass) "
+            "WHERE n.nspname = current_schema() AND c.relkind = 'r' AND c.relname LIKE :prefix"
+        ),
+        {"table": TABLE, "prefix": f"{TABLE}_p%"},
+    )
+    return {name: pending for name, pending in rows if PARTITION_NAME.match(name)}
+
+
+def booking_range(now: datetime | None = None) -> tuple[datetime, datetime]:
+    """Период start_time, для которого есть партиции: [начало, конец)."""
+    current = _month_start(now or datetime.utcnow())
+    return retention_cutoff(now) or current, _add_months(current, settings.bookings_partitions_ahead + 1)
+
+
+def create_partition(conn: Connection, month: datetime) -> None:
+    """Создать партицию месяца, перенеся в неё подходящие строки из партиции по умолчанию."""
+    name = _partition_name(month)
+    if _relkind(conn, name) is not None:
+        return
+    bounds = {"start": month, "end": _add_months(month, 1)}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if _relkind(conn, DEFAULT_PARTITION) is not None:
+        conn.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                "WHERE start_time >= :start AND start_time < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ),
+            bounds,
+        )
+    conn.execute(
+        text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+        )
+    )
+
+
+def _drop_default_partition(conn: Connection) -> None:
+    """Разложить строки партиции по умолчанию по месяцам и удалить её.
+
+    Пока она существует, DETACH PARTITION CONCURRENTLY недоступен.
+    """
+    # Блокировка до конца транзакции: новые строки не попадут в default между
+    # выборкой месяцев и удалением.
+    conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE"))
+    months = conn.execute(text(f"SELECT DISTINCT date_trunc('month', start_time) FROM {DEFAULT_PARTITION}")).scalars()
+    for month in sorted(months):
+        create_partition(conn, month)
+    conn.execute(text(f"DROP TABLE {DEFAULT_PARTITION}"))
+
+
+def ensure_partitions(conn: Connection, months_ahead: int) -> None:
+    if _relkind(conn, DEFAULT_PARTITION) is not None:
+        _drop_default_partition(conn)
+    current = _month_start(datetime.utcnow())
+    month = retention_cutoff() or current
+    while month <= _add_months(current, months_ahead):
+        create_partition(conn, month)
+        month = _add_months(month, 1)
+
+
+def migrate_legacy_table(conn: Connection) -> None:
+    """Перевести обычную таблицу bookings (до партиционирования) в партиционированную."""
+    if _relkind(conn, TABLE) != "r":
+        return
+    legacy = f"{TABLE}_legacy"
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {legacy}"))
+    conn.execute(text(f"ALTER INDEX IF EXISTS {TABLE}_pkey RENAME TO {legacy}_pkey"))
+    for index in Booking.__table__.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    Booking.__table__.create(conn)
+    months = conn.execute(
+        text(f"SELECT DISTINCT date_trunc('month', start_time) FROM {legacy} WHERE start_time IS NOT NULL")
+    ).scalars()
+    for month in sorted(months):
+        create_partition(conn, month)
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    conn.execute(text(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {legacy}"))
+    conn.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+        )
+    )
+    conn.execute(text(f"DROP TABLE {legacy}"))
+
+
+def _export_partition(conn: Connection, name: str, target: Path) -> None:
+    """Выгрузить отсоединённую партицию в target, сохранив строки, которые уже там есть.
+
+    Файл публикуется только целиком (os.replace). Если процесс упал после
+    публикации, но до DROP TABLE, повторная выгрузка не задвоит строки: из
+    старого файла берутся только id, которых нет в таблице.
+    """
+    partial = target.with_suffix(".tmp")
+    with gzip.open(partial, "wb") as archive:
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(f"COPY {name} ({', '.join(ARCHIVE_COLUMNS)}) TO STDOUT WITH CSV HEADER", archive)
+    if target.exists():
+        exported = set(conn.execute(text(f"SELECT id FROM {name}")).scalars())
+        with gzip.open(target, "rt", newline="") as previous, gzip.open(partial, "at", newline="") as archive:
+            writer = csv.writer(archive)
+            for row in csv.DictReader(previous):
+                if int(row["id"]) not in exported:
+                    writer.writerow(row[column] for column in ARCHIVE_COLUMNS)
+    os.replace(partial, target)
+
+
+def archive_partitions(conn: Connection, retention_months: int, archive_dir: str) -> list[str]:
+    """Отсоединить партиции старше срока хранения и выгрузить их в сжатые CSV-файлы.
+
+    conn должен быть в режиме AUTOCOMMIT: DETACH ... CONCURRENTLY не работает
+    внутри транзакции. Каждая партиция проходит шаги отсоединение → выгрузка →
+    публикация файла → удаление таблицы; прерванный шаг повторяется при
+    следующем запуске.
+    """
+    cutoff = _add_months(_month_start(datetime.utcnow()), -retention_months)
+    directory = Path(archive_dir)
+    archived = []
+    for name, pending in sorted(_partition_tables(conn).items()):
+        match = PARTITION_NAME.match(name)
+        if datetime(int(match[1]), int(match[2]), 1) >= cutoff:
+            continue
+        directory.mkdir(parents=True, exist_ok=True)
+        if pending is not None:
+            # Родительская таблица блокируется только в SHARE UPDATE EXCLUSIVE:
+            # чтение и запись бронирований продолжаются.
+            mode = "FINALIZE" if pending else "CONCURRENTLY"
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name} {mode}"))
+        _export_partition(conn, name, directory / f"{name}.csv.gz")
+        conn.execute(text(f"DROP TABLE {name}"))
+        archived.append(name)
+    return archived
+
+
+def maintain() -> bool:
+    """Создать партиции наперёд и заархивировать старые. False — если уже выполняется."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}).scalar()
+        if not locked:
+            return False
+        try:
+            with engine.begin() as transaction:
+                ensure_partitions(transaction, settings.bookings_partitions_ahead)
+            if settings.bookings_retention_months > 0:
+                archive_partitions(conn, settings.bookings_retention_months, settings.bookings_archive_dir)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+    return True
+
+
+def read_archived_bookings(
+    user_id: int, start: datetime, end: datetime, status: str | None = None
+) -> list[BookingPublic]:
+    """Бронирования пользователя из архива с start_time в [start, end).
+
+    Читаются только файлы месяцев, попадающих в период.
+    """
+    directory = Path(settings.bookings_archive_dir)
+    bookings = []
+    month = _month_start(start)
+    while month < end:
+        path = directory / f"{_partition_name(month)}.csv.gz"
+        month = _add_months(month, 1)
+        if not path.exists():
+            continue
+        with gzip.open(path, "rt", newline="") as archive:
+            for row in csv.DictReader(archive):
+                if int(row["user_id"]) != user_id or (status and row["status"] != status):
+                    continue
+                start_time = datetime.fromisoformat(row["start_time"])
+                if not start <= start_time < end:
+                    continue
+                bookings.append(
+                    BookingPublic(
+                        id=int(row["id"]),
+                        user_id=int(row["user_id"]),
+                        room_id=int(row["room_id"]),
+                        start_time=start_time,
+                        end_time=datetime.fromisoformat(row["end_time"]),
+                        status=row["status"],
+                        created_at=datetime.fromisoformat(row["created_at"]),
+                    )
+                )
+    return bookings
+
+
+if __name__ == "__main__":
+    print("done" if maintain() else "skipped: maintenance already running")
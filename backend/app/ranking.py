@@ -0,0 +1,203 @@
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import Booking, Favorite, Room, Venue, VenueScore
+from app.partitions import retention_cutoff, to_naive_utc
+
+FAVORITE_WEIGHT = 3.0
+BOOKING_WEIGHT = 5.0
+
+# Трендовый рейтинг — сумма весов событий с экспоненциальным затуханием.
+# Хранится как log2(sum(w * 2 ** ((t - EPOCH) / HALF_LIFE))): такое значение
+# не нужно пересчитывать с течением времени, порядок сортировки сохраняется.
+TRENDING_EPOCH = datetime(2024, 1, 1)
+TRENDING_HALF_LIFE_HOURS = 72.0
+# События старше окна вносят меньше 0.1% и при пересчёте не учитываются.
+TRENDING_WINDOW_HALF_LIVES = 10
+
+RECOMPUTE_LOCK_ID = 280_001
+
+# Популярность считает избранное за всё время, а бронирования — только с
+# start_time не старше срока хранения в БД (BOOKINGS_RETENTION_MONTHS).
+# Старые партиции уходят в архив, и без явного окна пересчёт молча терял бы их,
+# а инкрементальный путь — нет.
+
+
+def booking_counts(start_time: datetime) -> bool:
+    cutoff = retention_cutoff()
+    return cutoff is None or to_naive_utc(start_time) >= cutoff
+
+
+def _decay_exponent(at: datetime) -> float:
+    return (at - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS
+
+
+def _log2_add(a: float | None, b: float) -> float:
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def _log2_sub(a: float | None, b: float) -> float | None:
+    if a is None or b >= a:
+        return None
+    return a + math.log2(1 - 2 ** (b - a))
+
+
+def backfill_scores(db: Session | Connection) -> None:
+    """Создать нулевые строки рейтинга для заведений, у которых их ещё нет."""
+    db.execute(
+        insert(VenueScore)
+        .from_select(
+            ["venue_id", "popularity_score", "updated_at"],
+            select(Venue.id, literal(0.0), literal(datetime.utcnow())),
+        )
+        .on_conflict_do_nothing(index_elements=[VenueScore.venue_id])
+    )
+
+
+def record_event(db: Session, venue_id: int, weight: float, at: datetime) -> None:
+    """Учесть событие в рейтинге заведения; отрицательный вес отменяет событие.
+
+    Изменения попадают в текущую транзакцию, коммит делает вызывающий код.
+    """
+    db.execute(
+        insert(VenueScore)
+        .values(venue_id=venue_id, popularity_score=0.0, updated_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[VenueScore.venue_id])
+    )
+    score = db.query(VenueScore).filter(VenueScore.venue_id == venue_id).with_for_update().one()
+    score.popularity_score = max(score.popularity_score + weight, 0.0)
+    contribution = math.log2(abs(weight)) + _decay_exponent(at)
+    if weight > 0:
+        score.trending_score = _log2_add(score.trending_score, contribution)
+    else:
+        score.trending_score = _log2_sub(score.trending_score, contribution)
+    score.updated_at = datetime.utcnow()
+
+
+def recompute_scores(conn: Connection) -> bool:
+    """Полностью пересчитать рейтинги по избранному и активным бронированиям.
+
+    Агрегаты и текущие рейтинги читаются из одного снимка (REPEATABLE READ) без
+    блокировки venue_scores. Затем к каждой строке прибавляется разница между
+    пересчитанным значением и значением в снимке, поэтому события, учтённые
+    record_event после снимка, сохраняются. Строки блокируются только на время
+    записи. Возвращает False, если пересчёт уже выполняет другой процесс.
+    """
+    locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": RECOMPUTE_LOCK_ID}).scalar()
+    conn.commit()
+    if not locked:
+        return False
+    try:
+        with conn.begin():
+            conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            now = datetime.utcnow()
+            snapshot, totals = _read_snapshot(conn, now)
+        with conn.begin():
+            backfill_scores(conn)
+            _apply_deltas(conn, snapshot, totals, _decay_exponent(now))
+    finally:
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": RECOMPUTE_LOCK_ID})
+        conn.commit()
+    return True
+
+
+def _read_snapshot(conn: Connection, now: datetime):
+    half_life_seconds = TRENDING_HALF_LIFE_HOURS * 3600
+    window_start = now - timedelta(seconds=half_life_seconds * TRENDING_WINDOW_HALF_LIVES)
+    cutoff = retention_cutoff(now)
+    booking_window = [] if cutoff is None else [Booking.start_time >= cutoff]
+
+    def decayed(column):
+        age = func.extract("epoch", column) - (now - datetime(1970, 1, 1)).total_seconds()
+        return func.sum(func.power(2.0, age / half_life_seconds))
+
+    snapshot = {
+        venue_id: (popularity, trending)
+        for venue_id, popularity, trending in conn.execute(
+            select(VenueScore.venue_id, VenueScore.popularity_score, VenueScore.trending_score)
+        )
+    }
+    favorites = conn.execute(
+        select(
+            Favorite.venue_id,
+            func.count(Favorite.id),
+            decayed(Favorite.created_at).filter(Favorite.created_at >= window_start),
+        ).group_by(Favorite.venue_id)
+    ).all()
+    bookings = conn.execute(
+        select(
+            Room.venue_id,
+            func.count(Booking.id),
+            decayed(Booking.created_at).filter(Booking.created_at >= window_start),
+        )
+        .join(Room, Room.id == Booking.room_id)
+        .where(Booking.status == "active", *booking_window)
+        .group_by(Room.venue_id)
+    ).all()
+
+    # Трендовая часть — линейная сумма относительно момента now.
+    totals: dict[int, list[float]] = {}
+    for weight, rows in ((FAVORITE_WEIGHT, favorites), (BOOKING_WEIGHT, bookings)):
+        for venue_id, count, recent in rows:
+            total = totals.setdefault(venue_id, [0.0, 0.0])
+            total[0] += weight * count
+            total[1] += weight * float(recent or 0)
+    return snapshot, totals
+
+
+def _apply_deltas(
+    conn: Connection,
+    snapshot: dict[int, tuple[float, float | None]],
+    totals: dict[int, list[float]],
+    now_exponent: float,
+) -> None:
+    def linear(score: float | None) -> float:
+        return 0.0 if score is None else 2 ** (score - now_exponent)
+
+    deltas = {}
+    for venue_id in snapshot.keys() | totals.keys():
+        old_popularity, old_trending = snapshot.get(venue_id, (0.0, None))
+        popularity, recent = totals.get(venue_id, (0.0, 0.0))
+        popularity_delta = popularity - old_popularity
+        trending_delta = recent - linear(old_trending)
+        stale_trending = recent == 0 and old_trending is not None
+        if abs(popularity_delta) < 1e-9 and abs(trending_delta) < 1e-12 and not stale_trending:
+            continue
+        deltas[venue_id] = (popularity_delta, trending_delta)
+    if not deltas:
+        return
+
+    rows = conn.execute(
+        select(VenueScore.venue_id, VenueScore.popularity_score, VenueScore.trending_score)
+        .where(VenueScore.venue_id.in_(deltas))
+        .order_by(VenueScore.venue_id)
+        .with_for_update()
+    ).all()
+    now = datetime.utcnow()
+    for venue_id, popularity, trending in rows:
+        popularity_delta, trending_delta = deltas[venue_id]
+        recent = linear(trending) + trending_delta
+        conn.execute(
+            update(VenueScore)
+            .where(VenueScore.venue_id == venue_id)
+            .values(
+                popularity_score=max(popularity + popularity_delta, 0.0),
+                trending_score=math.log2(recent) + now_exponent if recent > 1e-12 else None,
+                updated_at=now,
+            )
+        )
+
+
+if __name__ == "__main__":
+    from app.db import engine
+
+    with engine.connect() as connection:
+        print("recomputed" if recompute_scores(connection) else "skipped: recompute already running")
@@ -127,3 +127,9 @@ class CommentPublic(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class CommentPreview(BaseModel):
+    post_id: int
+    total: int
+    comments: list[CommentPublic]
@@ -0,0 +1,64 @@
+import math
+import os
+
+# Схема создаётся один раз в мастер-процессе, воркеры её не трогают
+# независимо от INIT_DB_ON_STARTUP.
+os.environ["INIT_DB_ON_STARTUP"] = "0"
+
+from app.config import settings  # noqa: E402
+
+
+def available_cpus() -> int:
+    # cpu_count() в контейнере возвращает ядра хоста; учитываем affinity и квоту cgroup v2.
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+bind = f"{settings.app_host}:{settings.app_port}"
+# Воркеры асинхронные, поэтому по одному на ядро. У каждого свой пул соединений
+# к БД, и по умолчанию воркеров не больше, чем помещается в DB_CONNECTION_BUDGET:
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) <= DB_CONNECTION_BUDGET.
+connections_per_worker = settings.db_pool_size + settings.db_max_overflow
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or max(
+    1, min(available_cpus(), settings.db_connection_budget // connections_per_worker)
+)
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# `kill -HUP <pid мастера>` поднимает новые воркеры и завершает старые после
+# отработки текущих запросов. Из-за preload_app код приложения при этом НЕ
+# перечитывается и on_starting/init_db не выполняются: HUP годится для
+# перезапуска воркеров (память, конфигурация), но не для выката новой версии.
+# Новая версия выкатывается новым контейнером (или USR2 + WINCH + QUIT вне
+# контейнера) — тогда on_starting применит изменения схемы.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    from app.config import settings
+    from app.db import engine, init_db, wait_for_db
+
+    wait_for_db(settings.db_wait_timeout)
+    init_db()
+    # Соединения мастера не должны наследоваться воркерами после fork.
+    engine.dispose()
+
+
+def post_fork(server, worker):
+    from app.db import engine
+
+    engine.dispose(close=False)
@@ -0,0 +1,56 @@
+"""Замер холодного старта: время от запуска команды до первого ответа 200.
+
+    python scripts/measure_startup.py --url http://127.0.0.1:8000/ready -- ./entrypoint.sh
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def measure(command: list[str], url: str, timeout: float) -> float:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            if process.poll() is not None:
+                raise RuntimeError(f"process exited with code {process.returncode}")
+            time.sleep(0.01)
+        raise RuntimeError("timed out")
+    finally:
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        sys.exit("command is required")
+
+    results = [measure(command, args.url, args.timeout) for _ in range(args.runs)]
+    print(" ".join(f"{value:.2f}" for value in results))
+    print(f"median {statistics.median(results):.2f}s")
+
+
+if __name__ == "__main__":
+    main()